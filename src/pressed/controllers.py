@@ -7,6 +7,7 @@ from evdev import InputDevice, categorize
 from evdev import ecodes as e
 
 from pressed.digit_bitmaps import digit_bitmaps
+from pressed.mapping import Mapping, compile_mapping
 from pressed.pressed import Button, Knob
 
 
@@ -15,16 +16,36 @@ class Qwerty:
     See here for code to make lights blink: https://stackoverflow.com/questions/854393/change-keyboard-locks-in-python/858992#858992
     """
 
-    def __init__(self, path, key_map, grab=False, verbose=False):
+    def __init__(self, path, key_map=None, grab=False, verbose=False, mapping=None):
+        if key_map is not None and mapping is not None:
+            raise ValueError("Pass either key_map or mapping, not both")
+
         self.dev = InputDevice(path)
-        self.key_map = key_map
+        self.mapping = mapping or Mapping.from_dict(
+            {"qwerty": {"keys": list(key_map or [])}}
+        )
         self.grab = grab
         self.verbose = verbose
-        self.buttons = {key: Button(name=key) for key in key_map}
+
+        self.buttons = {}
+        self.remap(self.mapping.tables)
+        self.mapping.reload_callbacks.append(self.remap)
+
+        # Buttons pressed by each keycode, so the release is still handled even
+        # if a reload unmaps the key while it's held
+        self.held = {}
 
         if self.grab:
             self.dev.grab()  # This requires user in input group or run as root
 
+    def remap(self, tables):
+        # Existing buttons are kept, so held state and assigned actions survive
+        # a reload. Names that are no longer mapped simply stop being pressed
+        self.buttons = {
+            **{name: Button(name=name) for name in tables["qwerty"]["keys"].values()},
+            **self.buttons,
+        }
+
     def loop(self):
         for event in self.dev.read_loop():
             if event.type == e.EV_KEY:
@@ -32,12 +53,24 @@ class Qwerty:
                 if self.verbose:
                     print(event)
 
-                if event.keycode in self.key_map:
-                    if event.keystate == 1:  # Key down event
-                        print("pressing button: " + event.keycode)
-                        self.buttons[event.keycode].press()
-
-                    elif event.keystate == 0:  # Key up event, not key specific
+                # Codes with more than one name give a list of keycodes
+                keycodes = event.keycode
+                if not isinstance(keycodes, list):
+                    keycodes = [keycodes]
+
+                keys = self.mapping.tables["qwerty"]["keys"]
+                if event.keystate == 1:  # Key down event
+                    for keycode in keycodes:
+                        if keycode in keys:
+                            print("pressing button: " + keys[keycode])
+                            button = self.buttons[keys[keycode]]
+                            self.held[keycode] = button
+                            button.press()
+                            break
+
+                elif event.keystate == 0:  # Key up event, not key specific
+                    held = [self.held.pop(k, None) for k in keycodes]
+                    if any(held) or any(k in keys for k in keycodes):
                         for b in dict.values(self.buttons):
                             if b.pressed:
                                 b.release()
@@ -61,15 +94,30 @@ class Qwerty:
 
 
 class Infinity:
+    # Only used when no mapping is given
     button_map = {1: "left", 2: "center", 4: "right"}
 
-    def __init__(self, hold=0.45, double=0):  # .25 works for double
+    def __init__(self, hold=0.45, double=0, mapping=None):  # .25 works for double
+        self.hold = hold
+        self.double = double
+        self.mapping = mapping or Mapping.from_dict(
+            {"infinity": {"buttons": self.button_map}}
+        )
         self.open()
 
-        self.buttons = {
-            name: Button(hold, double, True, name, number)
-            for number, name in self.button_map.items()
-        }
+        self.buttons = {}
+        self.remap(self.mapping.tables)
+        self.mapping.reload_callbacks.append(self.remap)
+
+    def remap(self, tables):
+        # Keep existing buttons, so held state and assigned actions survive
+        buttons = dict(self.buttons)
+        for number, name in tables["infinity"]["buttons"].items():
+            if name in buttons:
+                buttons[name].number = number
+            else:
+                buttons[name] = Button(self.hold, self.double, True, name, number)
+        self.buttons = buttons
 
     def open(self):
         try:
@@ -100,19 +148,20 @@ class Infinity:
                     time.sleep(2)
                     continue
 
+            button_map = self.mapping.tables["infinity"]["buttons"]
             if press == 0:
                 for button in self.buttons.values():
                     if button.pressed:
                         button.release()
 
-            elif press in [1, 2, 4]:
-                name = self.button_map[press]
+            elif press in button_map:
+                name = button_map[press]
                 self.buttons[name].press()
 
             else:
                 for button in self.buttons.values():
                     if button.pressed and button.simultaneous:
-                        new_button = self.button_map(press - button.number)
+                        new_button = button_map.get(press - button.number)
                         button.simultaneous_press(new_button)
 
     def start_loop_thread(self):
@@ -122,46 +171,106 @@ class Infinity:
 
 
 class LPD8:
-    def __init__(self):
+    def __init__(self, mapping=None):
         self.midi_in = rtmidi.MidiIn(name="lpd8")
         self.midi_in.open_virtual_port("lpd8")
 
         self.midi_out = rtmidi.MidiOut(name="lpd8")
         self.midi_out.open_virtual_port("lpd8")
 
+        self.mapping = mapping or Mapping()
+        self.pads = []
+        self.ccs = []
+        self.knobs = []
+        self.remap(self.mapping.tables)
+        self.mapping.reload_callbacks.append(self.remap)
+
+        # Buttons pressed by each (group, note), so the release goes to the same
+        # button even if a reload remaps the note while it's held
+        self.held = {}
+
         self.callbacks = []
         self.midi_in.set_callback(self.respond)
 
-        self.pads = [Button(name="pad", number=i, lit="off") for i in range(8)]
-        self.ccs = [Button(name="cc", number=i, lit="off") for i in range(8)]
-        self.knobs = [Knob(name="knob", number=i) for i in range(8)]
-
-        self.midi_root = 36
         self.blink_time = 0.4
 
+    @property
+    def midi_root(self):
+        return self.mapping.tables["lpd8"]["pad_notes"][0]
+
+    @midi_root.setter
+    def midi_root(self, root):
+        # Moves both the pads and ccs to start from the root, in this device's
+        # mapping. Reloading the mapping file replaces this again
+        current = self.mapping.tables["lpd8"]
+        settings = {
+            "pads": {"start": root, "count": len(current["pad_notes"])},
+            "ccs": {"start": root, "count": len(current["cc_notes"])},
+            "knobs": sorted(current["knobs"], key=current["knobs"].get),
+        }
+        tables = dict(self.mapping.tables)
+        tables["lpd8"] = compile_mapping({"lpd8": settings})["lpd8"]
+        self.mapping.swap(tables)
+
+    def remap(self, tables):
+        # Buttons are only ever added, so held state and assigned actions survive
+        tables = tables["lpd8"]
+        self.pads = self.pads + [
+            Button(name="pad", number=i, lit="off")
+            for i in range(len(self.pads), len(tables["pad_notes"]))
+        ]
+        self.ccs = self.ccs + [
+            Button(name="cc", number=i, lit="off")
+            for i in range(len(self.ccs), len(tables["cc_notes"]))
+        ]
+        self.knobs = self.knobs + [
+            Knob(name="knob", number=i)
+            for i in range(len(self.knobs), len(tables["knobs"]))
+        ]
+
     def send(self, *msg):
         self.midi_out.send_message(msg)
 
     def respond(self, data, extra):
         msg = data[0]
-        if msg[0] == 176 and msg[1] in range(1, 9):  # CC messages for knobs
-            self.knobs[msg[1] - 1].update(msg[2] / 127)
-        elif msg[1] in range(36, 44):
+        # Use the same tables for the whole event, even if a reload swaps them
+        tables = self.mapping.tables["lpd8"]
+        if msg[0] == 176 and msg[1] in tables["knobs"]:  # CC messages for knobs
+            self.knobs[tables["knobs"][msg[1]]].update(msg[2] / 127)
+        else:
             if msg[0] == 144:
-                self.pads[msg[1] - self.midi_root].press()
+                handled = self.dispatch(tables, "pads", msg[1], True)
             elif msg[0] == 128:
-                self.pads[msg[1] - self.midi_root].release()
+                handled = self.dispatch(tables, "pads", msg[1], False)
             elif msg[0] == 176:
-                if msg[2] > 0:
-                    self.ccs[msg[1] - self.midi_root].press()
-                else:
-                    self.ccs[msg[1] - self.midi_root].release()
+                handled = self.dispatch(tables, "ccs", msg[1], msg[2] > 0)
+            else:
+                handled = False
 
-            self.light()
+            if handled:
+                self.light()
 
         for f in self.callbacks:
             f(msg)
 
+    def dispatch(self, tables, group, note, pressed):
+        "Press or release the button mapped to a note. Returns False if the note isn't mapped."
+        buttons = getattr(self, group)
+        if pressed:
+            if note not in tables[group]:
+                return False
+            button = buttons[tables[group][note]]
+            self.held[(group, note)] = button
+            button.press()
+        else:
+            button = self.held.pop((group, note), None)
+            if button is None:
+                if note not in tables[group]:
+                    return False
+                button = buttons[tables[group][note]]
+            button.release()
+        return True
+
     def light(self):
         if time.time() % (self.blink_time) > self.blink_time / 2:
             blink_slow = True
@@ -173,25 +282,33 @@ class LPD8:
             blink_slow = False
             blink_fast = False
 
+        tables = self.mapping.tables["lpd8"]
+
         for b in self.pads:
+            note = tables["pad_notes"].get(b.number)
+            if note is None:  # No longer mapped
+                continue
             if (
                 b.lit == "on"
                 or (b.lit == "blink_fast" and blink_fast)
                 or (b.lit == "blink_slow" and blink_slow)
             ):
-                self.send(144, self.midi_root + b.number, 127)
+                self.send(144, note, 127)
             else:
-                self.send(128, self.midi_root + b.number, 0)
+                self.send(128, note, 0)
 
         for b in self.ccs:
+            note = tables["cc_notes"].get(b.number)
+            if note is None:
+                continue
             if (
                 b.lit == "on"
                 or (b.lit == "blink_fast" and blink_fast)
                 or (b.lit == "blink_slow" and blink_slow)
             ):
-                self.send(176, self.midi_root + b.number, 127)
+                self.send(176, note, 127)
             else:
-                self.send(176, self.midi_root + b.number, 0)
+                self.send(176, note, 0)
 
     def light_loop(self):
         while 1:
@@ -216,13 +333,19 @@ class APCMini:
         "blink_orange": 6,
     }
 
-    def __init__(self):
+    def __init__(self, mapping=None):
         self.midi_in = rtmidi.MidiIn(name="apc_input")
         self.midi_in.open_virtual_port("apc_input")
 
         self.midi_out = rtmidi.MidiOut(name="apc_output")
         self.midi_out.open_virtual_port("apc_output")
 
+        self.mapping = mapping or Mapping()
+
+        # Button positions pressed by each note, so the release goes to the same
+        # position even if a reload remaps the note while it's held
+        self.held = {}
+
         self.callbacks = []
         self.midi_in.set_callback(self.respond)
 
@@ -235,6 +358,8 @@ class APCMini:
         # Add sliders
         self.sliders = [Knob(name=f"slider_{i}", number=i) for i in range(9)]
 
+        self.mapping.reload_callbacks.append(self.remap)
+
     def add_button_set(self, **kwargs):
         button_set = APCMiniButtons(self, **kwargs)
         self.button_sets.append(button_set)
@@ -264,6 +389,26 @@ class APCMini:
             if old_button.lit != new_button.lit:
                 self.light_button(new_button)
 
+    def remap(self, tables):
+        # The buttons themselves are kept, only their notes change, so held
+        # state and assigned actions survive a reload
+        notes = tables["apc_mini"]["notes"]
+        changed = []
+        for button_set in self.button_sets:
+            for position, note in notes.items():
+                button = button_set.lookup(*position)
+                if button.number != note:
+                    changed.append((button, note))
+
+        # Turn off all the old notes before lighting the new ones, in case
+        # buttons have swapped notes
+        for button, note in changed:
+            if button in self.buttons:
+                self.light(button.number, "off")
+        for button, note in changed:
+            button.number = note
+            self.light_button(button)
+
     def light(self, number, state):
         "Controls lighting of buttons to the following states: off, green, blink_green, red, blink_red, orange, blink_orange."
         self.send(144, number, self.light_codes[state])
@@ -292,23 +437,29 @@ class APCMini:
         """
 
         msg = data[0]
+        # Use the same tables for the whole event, even if a reload swaps them
+        tables = self.mapping.tables["apc_mini"]
 
         # Handle sliders
-        if msg[0] == 176 and msg[1] >= 48 and msg[1] <= 56:
-            self.sliders[msg[1] - 48].update(msg[2] / 127)
+        if msg[0] == 176 and msg[1] in tables["sliders"]:
+            slider = self.sliders[tables["sliders"][msg[1]]]
+            slider.update(msg[2] / 127)
             for f in self.callbacks:
-                f(self.sliders[msg[1] - 48], msg[2])
+                f(slider, msg[2])
             return
 
         if msg[0] == 144:
-            button = self.buttons[msg[1]]
+            position = tables["buttons"][msg[1]]
+            self.held[msg[1]] = position
+            button = self.buttons.lookup(*position)
             button.press()
         elif msg[0] == 128:
+            position = self.held.pop(msg[1], None) or tables["buttons"][msg[1]]
             # On release, we need to trigger all sets, because a press might
             # have switched the button set. Releasing an inactive button
             # shouldn't have any bad effects (I hope!)
             for set in self.button_sets:
-                button = set[msg[1]]
+                button = set.lookup(*position)
                 button.release()
 
         for f in self.callbacks:
@@ -334,7 +485,8 @@ class APCMiniButton(Button):
         super().__init__(hold_time, double_time, wait_hold, name, number)
 
     def light(self, state):
-        if self.number == 98 and state != "off":
+        shift = self.apc.mapping.tables["apc_mini"]["notes"][("shift", 0)]
+        if self.number == shift and state != "off":
             raise ValueError("Cannot light the shift button")
         self.lit = state
         self.apc.light_button(self)
@@ -347,37 +499,37 @@ class APCMiniButtons:
 
     def __init__(self, apc, grid=None, bottom_row=None, right_column=None, shift=None):
         self.apc = apc
+        notes = apc.mapping.tables["apc_mini"]["notes"]
         # Number attribute here refers to the midi note used for I/O
         # Grid is indexed left to right, bottom to top
         # Right column is indexed top to bottom
-        self.grid = grid or [APCMiniButton(apc, number=i) for i in range(64)]
+        self.grid = grid or [
+            APCMiniButton(apc, number=notes[("grid", i)]) for i in range(64)
+        ]
         self.bottom_row = bottom_row or [
-            APCMiniButton(apc, number=64 + i) for i in range(8)
+            APCMiniButton(apc, number=notes[("bottom_row", i)]) for i in range(8)
         ]
         self.right_column = right_column or [
-            APCMiniButton(apc, number=82 + i) for i in range(8)
+            APCMiniButton(apc, number=notes[("right_column", i)]) for i in range(8)
         ]
 
-        self.shift = shift or APCMiniButton(apc, number=98)
+        self.shift = shift or APCMiniButton(apc, number=notes[("shift", 0)])
 
         # For 2D indexing, left to right and top to bottom
         self.grid_columns = [[] for i in range(8)]
         for i in range(64):
             self.grid_columns[i % 8].insert(0, self.grid[i])
 
+    def lookup(self, group, index):
+        "Get a button by its position, as stored in the compiled mapping tables."
+        if group == "shift":
+            return self.shift
+        return getattr(self, group)[index]
+
     def __getitem__(self, number):
         try:
-            if number >= 0 and number < 64:
-                return self.grid[number]
-            elif number >= 64 and number < 72:
-                return self.bottom_row[number - 64]
-            elif number >= 82 and number < 90:
-                return self.right_column[number - 82]
-            elif number == 98:
-                return self.shift
-            else:
-                raise IndexError
-        except:
+            return self.lookup(*self.apc.mapping.tables["apc_mini"]["buttons"][number])
+        except (KeyError, TypeError):
             raise IndexError from None
 
     def __iter__(self):
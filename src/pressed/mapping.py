@@ -0,0 +1,342 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from threading import Lock, Thread
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# Bump this whenever the layout of the compiled tables changes, so that stale
+# cache files are ignored rather than loaded
+CACHE_VERSION = 1
+
+# Groups of numbers can be given either as a list, or as a table with a start
+# and a count for consecutive runs. The shift button is a single note
+DEFAULTS = {
+    "qwerty": {"keys": []},
+    "infinity": {"buttons": {"1": "left", "2": "center", "4": "right"}},
+    "lpd8": {
+        "pads": {"start": 36, "count": 8},
+        "ccs": {"start": 36, "count": 8},
+        "knobs": {"start": 1, "count": 8},
+    },
+    "apc_mini": {
+        "grid": {"start": 0, "count": 64},
+        "bottom_row": {"start": 64, "count": 8},
+        "right_column": {"start": 82, "count": 8},
+        "shift": 98,
+        "sliders": {"start": 48, "count": 9},
+    },
+}
+
+# The APC Mini's layout is fixed by the hardware, only the notes can change
+APC_MINI_SIZES = {
+    "grid": 64,
+    "bottom_row": 8,
+    "right_column": 8,
+    "shift": 1,
+    "sliders": 9,
+}
+
+
+def _is_int(value):
+    # bool is a subclass of int, but true and false aren't meaningful numbers
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _numbers(value, group):
+    if isinstance(value, dict):
+        start, count = value["start"], value["count"]
+        if not (_is_int(start) and _is_int(count)) or count < 1:
+            raise ValueError(f"{group} needs an integer start and a count of at least 1")
+        numbers = list(range(start, start + count))
+    elif _is_int(value):
+        numbers = [value]
+    elif isinstance(value, list):
+        numbers = value
+    else:
+        raise ValueError(f"{group} must be a number, a list of numbers or a range")
+
+    if not numbers:
+        raise ValueError(f"{group} needs at least one number")
+    for number in numbers:
+        if not _is_int(number) or not 0 <= number <= 127:
+            raise ValueError(f"{group} has {number!r}, which isn't a MIDI number")
+    return numbers
+
+
+def _name(name):
+    if not isinstance(name, str):
+        raise ValueError(f"Button names must be strings, not {name!r}")
+    return name
+
+
+def _index(numbers, group):
+    table = {}
+    for index, number in enumerate(numbers):
+        if number in table:
+            raise ValueError(f"Number {number} is used twice in {group}")
+        table[number] = index
+    return table
+
+
+def _compile_qwerty(config):
+    keys = config["keys"]
+    # A plain list of keycodes names each button after its key
+    if not isinstance(keys, dict):
+        keys = {key: key for key in keys}
+    return {"keys": {_name(key): _name(name) for key, name in keys.items()}}
+
+
+def _compile_infinity(config):
+    # TOML and JSON keys are always strings, but the pedal reports ints
+    return {
+        "buttons": {
+            int(code): _name(name) for code, name in config["buttons"].items()
+        }
+    }
+
+
+def _compile_lpd8(config):
+    pads = _numbers(config["pads"], "pads")
+    ccs = _numbers(config["ccs"], "ccs")
+    return {
+        "pads": _index(pads, "pads"),
+        "pad_notes": dict(enumerate(pads)),
+        "ccs": _index(ccs, "ccs"),
+        "cc_notes": dict(enumerate(ccs)),
+        "knobs": _index(_numbers(config["knobs"], "knobs"), "knobs"),
+    }
+
+
+def _compile_apc_mini(config):
+    groups = {group: _numbers(config[group], group) for group in APC_MINI_SIZES}
+    for group, numbers in groups.items():
+        if len(numbers) != APC_MINI_SIZES[group]:
+            raise ValueError(
+                f"Expected {APC_MINI_SIZES[group]} numbers for {group}, got {len(numbers)}"
+            )
+
+    buttons = {}
+    notes = {}
+    for group in ("grid", "bottom_row", "right_column", "shift"):
+        for index, note in enumerate(groups[group]):
+            if note in buttons:
+                raise ValueError(f"Note {note} is used for more than one button")
+            buttons[note] = (group, index)
+            notes[(group, index)] = note
+
+    return {
+        "buttons": buttons,
+        "notes": notes,
+        "sliders": _index(groups["sliders"], "sliders"),
+    }
+
+
+COMPILERS = {
+    "qwerty": _compile_qwerty,
+    "infinity": _compile_infinity,
+    "lpd8": _compile_lpd8,
+    "apc_mini": _compile_apc_mini,
+}
+
+
+def compile_mapping(config):
+    """
+    Compile a mapping config into flat lookup tables for each device. Devices missing from the config, or settings missing for a device, fall back to the defaults.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("Mapping must be a table of devices")
+
+    unknown = set(config) - set(COMPILERS)
+    if unknown:
+        raise ValueError(f"Unknown devices in mapping: {', '.join(sorted(unknown))}")
+
+    tables = {}
+    for device, compiler in COMPILERS.items():
+        settings = config.get(device, {})
+        if not isinstance(settings, dict):
+            raise ValueError(f"Mapping for {device} must be a table of settings")
+
+        unknown = set(settings) - set(DEFAULTS[device])
+        if unknown:
+            raise ValueError(
+                f"Unknown settings for {device}: {', '.join(sorted(unknown))}"
+            )
+
+        try:
+            tables[device] = compiler({**DEFAULTS[device], **settings})
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid mapping for {device}: {e!r}") from None
+    return tables
+
+
+def parse_mapping(content, path):
+    "Parse the raw bytes of a mapping file, as TOML or JSON depending on the extension."
+    if path.endswith(".toml"):
+        return tomllib.loads(content.decode())
+    else:
+        return json.loads(content)
+
+
+# The tables use ints and tuples as keys, which JSON can't represent, so each
+# table is stored as a list of key value pairs instead
+def _encode(tables):
+    return {
+        device: {
+            name: [[key, value] for key, value in table.items()]
+            for name, table in device_tables.items()
+        }
+        for device, device_tables in tables.items()
+    }
+
+
+def _freeze(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _decode(data):
+    return {
+        device: {
+            name: {_freeze(key): _freeze(value) for key, value in pairs}
+            for name, pairs in device_tables.items()
+        }
+        for device, device_tables in data.items()
+    }
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pressed")
+
+
+class Mapping:
+    """
+    Holds the compiled lookup tables for each device, optionally loaded from a TOML or JSON mapping file. Compiled tables are cached on disk, keyed by a hash of the file's contents.
+
+    Devices read `tables` once per incoming event and never modify it. A reload compiles a whole new set of tables and swaps them in with a single assignment, so every event is dispatched with either the old tables or the new ones, never a mix.
+    """
+
+    def __init__(self, path=None, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.mtime = None
+        self.lock = Lock()
+
+        # Called with the new tables just before they are swapped in, so devices
+        # can create buttons for any new names before events can refer to them
+        self.reload_callbacks = []
+
+        if path:
+            self.tables = self.load()
+        else:
+            self.tables = compile_mapping({})
+
+    @classmethod
+    def from_dict(cls, config):
+        mapping = cls()
+        mapping.tables = compile_mapping(config)
+        return mapping
+
+    def load(self):
+        self.mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "rb") as f:
+            content = f.read()
+
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}:{os.path.splitext(self.path)[1]}:".encode())
+        # Settings missing from the file come from the defaults, so they are
+        # part of what the compiled tables depend on too
+        digest.update(json.dumps(DEFAULTS, sort_keys=True).encode())
+        digest.update(content)
+        cache_path = os.path.join(
+            self.cache_dir, f"{self.cache_prefix()}-{digest.hexdigest()}.json"
+        )
+
+        try:
+            with open(cache_path) as f:
+                return _decode(json.load(f))
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+
+        tables = compile_mapping(parse_mapping(content, self.path))
+        self.write_cache(cache_path, tables)
+        return tables
+
+    def cache_prefix(self):
+        "Cache files for each mapping file share a prefix, so old ones can be found and removed."
+        path = os.path.abspath(self.path).encode()
+        return hashlib.sha256(path).hexdigest()[:16]
+
+    def write_cache(self, cache_path, tables):
+        # Write to a temporary file and rename it, so that a process reading the
+        # cache never sees a partially written file. The cache is only an
+        # optimization, so failing to write it isn't an error
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                json.dump(_encode(tables), f)
+            os.replace(f.name, cache_path)
+
+            # Only the latest version of each mapping file is kept, so editing
+            # the file with hot reload doesn't grow the cache forever
+            prefix = self.cache_prefix() + "-"
+            for name in os.listdir(self.cache_dir):
+                old_path = os.path.join(self.cache_dir, name)
+                if name.startswith(prefix) and old_path != cache_path:
+                    os.remove(old_path)
+        except OSError:
+            pass
+
+    def reload(self):
+        """
+        Reload the mapping file and swap in the new tables. Returns True if the tables changed. If the file can't be loaded, or a device can't be remapped, the error is raised and the current tables stay in place.
+        """
+        if not self.path:
+            raise ValueError("Can't reload a mapping that wasn't loaded from a file")
+        with self.lock:
+            return self._swap(self.load())
+
+    def swap(self, tables):
+        "Swap in new tables, e.g. ones changed in code. Returns True if the tables changed."
+        with self.lock:
+            return self._swap(tables)
+
+    def _swap(self, tables):
+        if tables == self.tables:
+            return False
+
+        # Every device has to be ready for the new tables before they are
+        # swapped in, otherwise events could refer to buttons that don't exist.
+        # Devices only add buttons when remapping, so the old tables still work
+        # with any that were prepared before the failure
+        for f in self.reload_callbacks:
+            try:
+                f(tables)
+            except Exception as e:
+                raise ValueError(f"Couldn't apply mapping: {e!r}") from e
+        self.tables = tables
+        return True
+
+    def watch_loop(self, interval=1):
+        while 1:
+            time.sleep(interval)
+            try:
+                if os.stat(self.path).st_mtime_ns != self.mtime:
+                    if self.reload():
+                        print("Reloaded mapping from " + self.path)
+            except (OSError, ValueError) as e:
+                print(f"Couldn't reload mapping, keeping the current one: {e}")
+
+    def start_watch_thread(self, interval=1):
+        if not self.path:
+            raise ValueError("Can't watch a mapping that wasn't loaded from a file")
+        self.watch_thread = Thread(target=self.watch_loop, args=(interval,))
+        self.watch_thread.daemon = True
+        self.watch_thread.start()
@@ -0,0 +1,169 @@
+import sys
+import types
+
+import pytest
+
+# The hardware libraries aren't needed to test dispatching, so stand in for
+# them if they aren't installed. The tests below patch out everything they use
+for name in ("hid", "rtmidi", "evdev"):
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = types.ModuleType(name)
+sys.modules["evdev"].__dict__.setdefault("InputDevice", None)
+sys.modules["evdev"].__dict__.setdefault("categorize", None)
+sys.modules["evdev"].__dict__.setdefault("ecodes", None)
+
+from pressed import controllers  # noqa: E402
+from pressed.mapping import Mapping, compile_mapping  # noqa: E402
+
+
+class FakeMidi:
+    def __init__(self, name=None):
+        self.sent = []
+
+    def open_virtual_port(self, name):
+        pass
+
+    def set_callback(self, callback):
+        pass
+
+    def send_message(self, msg):
+        self.sent.append(tuple(msg))
+
+
+class FakeKeyboard:
+    def __init__(self, path):
+        self.events = []
+
+    def read_loop(self):
+        # Events are either (keycode, keystate) or a function to call between
+        # events, such as a reload
+        for event in self.events:
+            if callable(event):
+                event()
+            else:
+                keycode, keystate = event
+                yield types.SimpleNamespace(
+                    type=1, keycode=keycode, keystate=keystate
+                )
+
+
+@pytest.fixture(autouse=True)
+def fake_hardware(monkeypatch):
+    monkeypatch.setattr(
+        controllers,
+        "rtmidi",
+        types.SimpleNamespace(MidiIn=FakeMidi, MidiOut=FakeMidi),
+    )
+    monkeypatch.setattr(controllers, "InputDevice", FakeKeyboard)
+    monkeypatch.setattr(controllers, "categorize", lambda event: event)
+    monkeypatch.setattr(controllers, "e", types.SimpleNamespace(EV_KEY=1))
+
+
+def record(button, log):
+    button.press_action = lambda b: log.append(("press", b))
+    button.release_action = lambda b: log.append(("release", b))
+
+
+def swap(mapping, config):
+    assert mapping.swap(compile_mapping(config))
+
+
+def test_lpd8_release_after_remap():
+    lpd8 = controllers.LPD8()
+    log = []
+    for pad in lpd8.pads:
+        record(pad, log)
+
+    lpd8.respond([[144, 36, 100]], None)
+    swap(lpd8.mapping, {"lpd8": {"pads": {"start": 40, "count": 8}}})
+    lpd8.respond([[128, 36, 0]], None)
+
+    assert log == [("press", lpd8.pads[0]), ("release", lpd8.pads[0])]
+
+    # The new notes are used from then on
+    lpd8.respond([[144, 36, 100]], None)
+    lpd8.respond([[144, 41, 100]], None)
+    assert log[2:] == [("press", lpd8.pads[1])]
+
+
+def test_lpd8_midi_root():
+    lpd8 = controllers.LPD8()
+    lpd8.midi_root = 40
+    assert lpd8.midi_root == 40
+    assert lpd8.mapping.tables["lpd8"]["knobs"][1] == 0
+
+    lpd8.respond([[144, 40, 100]], None)
+    assert lpd8.pads[0].pressed
+
+
+def test_apc_mini_release_after_remap():
+    apc = controllers.APCMini()
+    log = []
+    for button in apc.buttons:
+        record(button, log)
+
+    apc.respond([[144, 5, 127]], None)
+    swap(apc.mapping, {"apc_mini": {"grid": list(reversed(range(64)))}})
+    apc.respond([[128, 5, 0]], None)
+
+    grid = apc.buttons.grid
+    assert log == [("press", grid[5]), ("release", grid[5])]
+    assert grid[5].number == 58
+
+    apc.respond([[144, 5, 127]], None)
+    assert log[2:] == [("press", grid[58])]
+
+
+def test_apc_mini_remap_relights():
+    apc = controllers.APCMini()
+    apc.buttons.grid[0].light("red")
+    apc.midi_out.sent = []
+
+    swap(apc.mapping, {"apc_mini": {"grid": list(reversed(range(64)))}})
+
+    assert (144, 0, 0) in apc.midi_out.sent
+    assert (144, 63, 3) in apc.midi_out.sent
+    # The old note is turned off before the new one is lit
+    sent = apc.midi_out.sent
+    assert sent.index((144, 0, 0)) < sent.index((144, 63, 3))
+
+
+def test_qwerty_release_after_unmap():
+    mapping = Mapping.from_dict({"qwerty": {"keys": ["KEY_A"]}})
+    qwerty = controllers.Qwerty("keyboard", mapping=mapping)
+    button = qwerty.buttons["KEY_A"]
+    log = []
+    record(button, log)
+
+    qwerty.dev.events = [
+        ("KEY_A", 1),
+        lambda: swap(mapping, {"qwerty": {"keys": ["KEY_B"]}}),
+        ("KEY_A", 0),
+    ]
+    qwerty.loop()
+
+    assert log == [("press", button), ("release", button)]
+    assert not button.pressed
+
+
+def test_qwerty_keycode_list():
+    qwerty = controllers.Qwerty("keyboard", key_map=["KEY_MUTE"])
+    button = qwerty.buttons["KEY_MUTE"]
+    log = []
+    record(button, log)
+
+    qwerty.dev.events = [
+        (["KEY_MIN_INTERESTING", "KEY_MUTE"], 1),
+        (["KEY_MIN_INTERESTING", "KEY_MUTE"], 0),
+        (["KEY_UNMAPPED", "KEY_OTHER"], 1),
+    ]
+    qwerty.loop()
+
+    assert log == [("press", button), ("release", button)]
+
+
+def test_qwerty_key_map_and_mapping():
+    with pytest.raises(ValueError):
+        controllers.Qwerty("keyboard", key_map=["KEY_A"], mapping=Mapping())
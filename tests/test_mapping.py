@@ -0,0 +1,139 @@
+import json
+import os
+
+import pytest
+
+from pressed.mapping import Mapping, _decode, _encode, compile_mapping
+
+
+def write(path, config):
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+
+def test_defaults():
+    tables = compile_mapping({})
+    assert tables["infinity"]["buttons"] == {1: "left", 2: "center", 4: "right"}
+    assert tables["lpd8"]["pads"][36] == 0
+    assert tables["lpd8"]["knobs"][8] == 7
+    assert tables["apc_mini"]["buttons"][98] == ("shift", 0)
+    assert tables["apc_mini"]["notes"][("bottom_row", 0)] == 64
+    assert tables["apc_mini"]["sliders"][56] == 8
+
+
+def test_settings_override_defaults():
+    tables = compile_mapping(
+        {
+            "qwerty": {"keys": ["KEY_A"]},
+            "lpd8": {"pads": [40, 41]},
+        }
+    )
+    assert tables["qwerty"]["keys"] == {"KEY_A": "KEY_A"}
+    assert tables["lpd8"]["pads"] == {40: 0, 41: 1}
+    assert tables["lpd8"]["ccs"][36] == 0
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        [],
+        5,
+        {"keyboard": {}},
+        {"lpd8": 5},
+        {"lpd8": {"pad": [40]}},
+        {"lpd8": {"pads": [40, 40]}},
+        {"lpd8": {"pads": {"start": 40}}},
+        {"lpd8": {"pads": "36"}},
+        {"lpd8": {"pads": []}},
+        {"lpd8": {"pads": {"start": 40, "count": 0}}},
+        {"lpd8": {"pads": {"start": "40", "count": 8}}},
+        {"lpd8": {"pads": [True]}},
+        {"lpd8": {"pads": [128]}},
+        {"qwerty": {"keys": {"KEY_A": 1}}},
+        {"qwerty": {"keys": [["KEY_A"]]}},
+        {"infinity": {"buttons": {"8": ["x"]}}},
+        {"infinity": {"buttons": ["left"]}},
+        {"apc_mini": {"shift": 0}},
+        {"apc_mini": {"bottom_row": [64]}},
+    ],
+)
+def test_invalid_configs(config):
+    with pytest.raises(ValueError):
+        compile_mapping(config)
+
+
+def test_encode_round_trip():
+    tables = compile_mapping({"qwerty": {"keys": {"KEY_A": "left"}}})
+    assert _decode(json.loads(json.dumps(_encode(tables)))) == tables
+
+
+def test_cache(tmp_path):
+    path = str(tmp_path / "mapping.json")
+    write(path, {"lpd8": {"pads": [40]}})
+    cache_dir = tmp_path / "cache"
+
+    mapping = Mapping(path, cache_dir=str(cache_dir))
+    assert len(os.listdir(cache_dir)) == 1
+    assert Mapping(path, cache_dir=str(cache_dir)).tables == mapping.tables
+
+    # Only the latest version of the file stays cached
+    write(path, {"lpd8": {"pads": [41]}})
+    mapping.reload()
+    write(path, {"lpd8": {"pads": [42]}})
+    mapping.reload()
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_reload(tmp_path):
+    path = str(tmp_path / "mapping.json")
+    write(path, {"lpd8": {"pads": [40]}})
+    mapping = Mapping(path, cache_dir=str(tmp_path / "cache"))
+    old_tables = mapping.tables
+
+    seen = []
+    mapping.reload_callbacks.append(seen.append)
+    assert not mapping.reload()
+    assert seen == []
+
+    write(path, {"lpd8": {"pads": [41]}})
+    assert mapping.reload()
+    assert seen == [mapping.tables]
+    assert mapping.tables["lpd8"]["pads"] == {41: 0}
+    # The old tables are replaced, not modified
+    assert old_tables["lpd8"]["pads"] == {40: 0}
+
+
+def test_failed_reload_keeps_tables(tmp_path):
+    path = str(tmp_path / "mapping.json")
+    write(path, {"lpd8": {"pads": [40]}})
+    mapping = Mapping(path, cache_dir=str(tmp_path / "cache"))
+    tables = mapping.tables
+
+    write(path, [])
+    with pytest.raises(ValueError):
+        mapping.reload()
+    assert mapping.tables is tables
+
+
+def test_failing_callback_keeps_tables(tmp_path):
+    path = str(tmp_path / "mapping.json")
+    write(path, {})
+    mapping = Mapping(path, cache_dir=str(tmp_path / "cache"))
+    tables = mapping.tables
+
+    def fail(tables):
+        raise RuntimeError
+
+    mapping.reload_callbacks.append(fail)
+    write(path, {"lpd8": {"pads": [41]}})
+    with pytest.raises(ValueError):
+        mapping.reload()
+    assert mapping.tables is tables
+
+
+def test_reload_without_file():
+    mapping = Mapping.from_dict({})
+    with pytest.raises(ValueError):
+        mapping.reload()
+    with pytest.raises(ValueError):
+        mapping.start_watch_thread()